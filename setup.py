@@ -9,6 +9,8 @@ setup(
     packages=[PACKAGE_NAME],
     # This is important as well
     install_requires=["setuptools"],
+    # orjson is used for faster reading/writing of JSON files if available
+    extras_require={"orjson": ["orjson"]},
     zip_safe=True,
     maintainer="Felix Widmaier",
     maintainer_email="felix.widmaier@tue.mpg.de",
@@ -0,0 +1,92 @@
+"""Tests for the monitoring of the launcher node."""
+
+__copyright__ = "Copyright (c) 2021 Max Planck Gesellschaft"
+__license__ = "BSD 3-Clause"
+
+import logging
+import os
+import signal
+import time
+
+import pytest
+
+from trifingerpro_runner import process_runner
+from trifingerpro_runner.process_runner import ProcessRunner
+
+# the launcher node is a ROS node
+pytest.importorskip("rclpy")
+from trifingerpro_runner.launcher_node import (  # noqa: E402
+    TrifingerLauncherNode,
+)
+
+
+#: Command of a fake node that runs until it receives SIGTERM and then shuts
+#: down successfully (which takes a moment).
+NODE_CMD = [
+    "sh",
+    "-c",
+    'sleep 30 & trap "sleep 0.3; kill $!; exit 0" TERM; wait',
+]
+
+
+class _Runner(ProcessRunner):
+    def __init__(self, cmd):
+        self._start_process(cmd)
+
+    def kill(self):
+        self._proc.kill()
+        self.wait()
+
+
+@pytest.fixture(params=["epoll", "polling"])
+def watcher_mode(request, monkeypatch):
+    """Run the test with both modes of the exit watcher."""
+    if request.param == "epoll":
+        pidfd = process_runner._pidfd_open(os.getpid())
+        if pidfd is None:
+            pytest.skip("pidfds are not supported")
+        os.close(pidfd)
+    else:
+        monkeypatch.setattr(process_runner, "_pidfd_open", lambda pid: None)
+
+    return request.param
+
+
+@pytest.fixture
+def node():
+    # no need to initialise ROS, the shutdown services are replaced by the
+    # test
+    node = TrifingerLauncherNode.__new__(TrifingerLauncherNode)
+    node.get_logger = lambda: logging.getLogger("test")
+    return node
+
+
+def test_shutdown_after_user_code_terminated(node, watcher_mode):
+    data = _Runner(NODE_CMD)
+    backend = _Runner(NODE_CMD)
+    user = _Runner(["sleep", "0.2"])
+    runners = (data, backend, user)
+
+    node._shutdown_backend = lambda: backend._proc.send_signal(signal.SIGTERM)
+    node._shutdown_data = lambda: data._proc.send_signal(signal.SIGTERM)
+
+    try:
+        start = time.monotonic()
+        assert node._monitor_nodes(data, backend, user)
+        duration = time.monotonic() - start
+    finally:
+        for runner in runners:
+            if runner.is_running():
+                runner.kill()
+            runner.close()
+
+    assert data.returncode == 0
+    assert backend.returncode == 0
+
+    # When polling, the termination of the user code is only noticed with the
+    # next check (after 3 seconds).  The nodes that are shut down afterwards
+    # do not exit immediately, so they are missed by the check directly after
+    # the shutdown.  They must be waited for directly instead of adding
+    # further polling intervals.
+    max_duration = 5 if watcher_mode == "polling" else 2
+    assert duration < max_duration
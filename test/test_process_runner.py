@@ -0,0 +1,155 @@
+"""Tests for the process runner base class and the exit watcher."""
+
+__copyright__ = "Copyright (c) 2021 Max Planck Gesellschaft"
+__license__ = "BSD 3-Clause"
+
+import os
+import subprocess
+import threading
+import time
+
+import pytest
+
+from trifingerpro_runner import process_runner
+from trifingerpro_runner.process_runner import ExitWatcher, ProcessRunner
+from trifingerpro_runner.states import ProcessState
+
+
+def _pidfd_supported():
+    pidfd = process_runner._pidfd_open(os.getpid())
+    if pidfd is None:
+        return False
+    os.close(pidfd)
+    return True
+
+
+class _Runner(ProcessRunner):
+    def __init__(self, *cmd):
+        self._start_process(list(cmd))
+
+    def terminate(self):
+        # only kill the process, reaping it is up to the code under test
+        self._proc.kill()
+
+
+@pytest.fixture
+def runners():
+    """Factory for runners, which kills all of them when the test ends."""
+    started = []
+
+    def start(*cmd):
+        runner = _Runner(*cmd)
+        started.append(runner)
+        return runner
+
+    yield start
+
+    for runner in started:
+        if runner.is_running():
+            runner.terminate()
+            runner.wait()
+        runner.close()
+
+
+@pytest.fixture(params=["epoll", "polling"])
+def watcher_mode(request, monkeypatch):
+    """Run the test with both modes of the exit watcher."""
+    if request.param == "epoll":
+        if not _pidfd_supported():
+            pytest.skip("pidfds are not supported")
+    else:
+        monkeypatch.setattr(process_runner, "_pidfd_open", lambda pid: None)
+
+    return request.param
+
+
+def _timed_wait(watcher):
+    start = time.monotonic()
+    watcher.wait()
+    return time.monotonic() - start
+
+
+def test_state(runners):
+    success = runners("true")
+    error = runners("false")
+    running = runners("sleep", "30")
+
+    assert success.wait(10)
+    assert error.wait(10)
+    assert not running.wait(0.01)
+
+    assert success.get_state() is ProcessState.TERMINATED_SUCCESS
+    assert success.returncode == 0
+    assert error.get_state() is ProcessState.TERMINATED_ERROR
+    assert error.returncode == 1
+    assert running.get_state() is ProcessState.RUNNING
+    assert running.returncode is None
+
+
+def test_watcher_mode(runners, watcher_mode):
+    watcher = ExitWatcher([runners("true")], poll_interval=0.05)
+    assert watcher.is_event_driven == (watcher_mode == "epoll")
+    watcher.close()
+
+
+def test_wait_until_first_terminates(runners, watcher_mode):
+    short = runners("sleep", "0.2")
+    long = runners("sleep", "30")
+    watcher = ExitWatcher([short, long], poll_interval=0.05)
+
+    assert _timed_wait(watcher) < 5
+    assert short.get_state() is ProcessState.TERMINATED_SUCCESS
+    assert long.get_state() is ProcessState.RUNNING
+
+    # The terminated process must not wake up the watcher again, i.e. the
+    # next call blocks until the other process terminates.
+    threading.Timer(0.3, long.terminate).start()
+    assert 0.25 < _timed_wait(watcher) < 5
+    assert long.get_state() is ProcessState.TERMINATED_ERROR
+
+    # all processes terminated, so it returns immediately
+    assert _timed_wait(watcher) < 1
+
+    watcher.close()
+
+
+def test_process_reaped_by_runner(runners, watcher_mode):
+    # a process that has already been reaped (e.g. by waiting for it) is
+    # still reported
+    short = runners("true")
+    long = runners("sleep", "30")
+    watcher = ExitWatcher([short, long], poll_interval=0.05)
+
+    short.wait(10)
+    assert short.returncode == 0
+
+    assert _timed_wait(watcher) < 5
+    assert long.get_state() is ProcessState.RUNNING
+
+    watcher.close()
+
+
+def test_foreign_child_process(runners, watcher_mode):
+    # A child process that is not watched terminates first and stays a
+    # zombie.  This must not prevent the watched processes from being
+    # detected.
+    foreign = subprocess.Popen(["true"])
+    try:
+        # give the foreign process time to terminate (without reaping it)
+        time.sleep(0.2)
+
+        short = runners("sleep", "0.2")
+        long = runners("sleep", "30")
+        watcher = ExitWatcher([short, long], poll_interval=0.05)
+
+        assert _timed_wait(watcher) < 5
+        assert short.get_state() is ProcessState.TERMINATED_SUCCESS
+        assert long.get_state() is ProcessState.RUNNING
+
+        threading.Timer(0.3, long.terminate).start()
+        assert _timed_wait(watcher) < 5
+        assert long.get_state() is ProcessState.TERMINATED_ERROR
+
+        watcher.close()
+    finally:
+        foreign.wait()
@@ -0,0 +1,97 @@
+"""Tests for the state machine tables of the launcher."""
+
+__copyright__ = "Copyright (c) 2021 Max Planck Gesellschaft"
+__license__ = "BSD 3-Clause"
+
+import itertools
+
+import pytest
+
+from trifingerpro_runner.states import (
+    ProcessState,
+    ProcessStateCompareWrapper,
+    LauncherState,
+    MonitorAction,
+    LAUNCHER_STATES,
+    STATE_TRANSITIONS,
+)
+
+
+RUNNING = ProcessState.RUNNING
+SUCCESS = ProcessState.TERMINATED_SUCCESS
+ERROR = ProcessState.TERMINATED_ERROR
+ANY = ProcessState.TERMINATED_ANY
+
+CONCRETE_STATES = (RUNNING, SUCCESS, ERROR)
+ALL_KEYS = list(itertools.product(CONCRETE_STATES, repeat=3))
+
+
+# Expected (action, is_error) for a selection of states, written down by hand
+# from the description of the shutdown sequence.
+EXPECTED_TRANSITIONS = [
+    # all running
+    ((RUNNING, RUNNING, RUNNING), MonitorAction.NONE, False),
+    # user code terminated first (its result does not matter)
+    ((RUNNING, RUNNING, SUCCESS), MonitorAction.SHUTDOWN_BACKEND, False),
+    ((RUNNING, RUNNING, ERROR), MonitorAction.SHUTDOWN_BACKEND, False),
+    # backend terminated while the user code is still running
+    (
+        (RUNNING, SUCCESS, RUNNING),
+        MonitorAction.TERMINATE_USER_AFTER_GRACE_TIME,
+        False,
+    ),
+    (
+        (RUNNING, ERROR, RUNNING),
+        MonitorAction.TERMINATE_USER_AFTER_GRACE_TIME,
+        True,
+    ),
+    # backend and user code terminated, data still running
+    ((RUNNING, SUCCESS, SUCCESS), MonitorAction.SHUTDOWN_DATA, False),
+    ((RUNNING, SUCCESS, ERROR), MonitorAction.SHUTDOWN_DATA, False),
+    ((RUNNING, ERROR, SUCCESS), MonitorAction.SHUTDOWN_DATA, True),
+    # data terminated while others are still running
+    ((SUCCESS, RUNNING, RUNNING), MonitorAction.TERMINATE_USER, True),
+    ((ERROR, RUNNING, RUNNING), MonitorAction.TERMINATE_USER, True),
+    ((SUCCESS, RUNNING, ERROR), MonitorAction.SHUTDOWN_BACKEND, True),
+    ((ERROR, SUCCESS, RUNNING), MonitorAction.TERMINATE_USER, True),
+    ((SUCCESS, ERROR, RUNNING), MonitorAction.TERMINATE_USER, True),
+    # all terminated
+    ((SUCCESS, SUCCESS, SUCCESS), MonitorAction.FINISH, False),
+    ((SUCCESS, SUCCESS, ERROR), MonitorAction.FINISH, False),
+    ((ERROR, SUCCESS, SUCCESS), MonitorAction.FINISH, True),
+    ((SUCCESS, ERROR, SUCCESS), MonitorAction.FINISH, True),
+    ((ERROR, ERROR, ERROR), MonitorAction.FINISH, True),
+]
+
+
+@pytest.mark.parametrize("key, action, is_error", EXPECTED_TRANSITIONS)
+def test_transitions(key, action, is_error):
+    assert STATE_TRANSITIONS[key] == (action, is_error)
+
+
+def test_all_states_are_expected():
+    # the state machine covers all combinations of concrete states
+    assert len(ALL_KEYS) == 27
+    assert set(STATE_TRANSITIONS) == set(ALL_KEYS)
+
+
+@pytest.mark.parametrize("key", ALL_KEYS)
+def test_launcher_states(key):
+    state = LAUNCHER_STATES[key]
+    assert state == LauncherState(*map(ProcessStateCompareWrapper, key))
+
+    # states are unique, so they can be compared by identity
+    other_states = [LAUNCHER_STATES[k] for k in ALL_KEYS if k != key]
+    assert all(state is not other for other in other_states)
+
+
+@pytest.mark.parametrize(
+    "a, b", list(itertools.product(ProcessState, repeat=2))
+)
+def test_compare_wrapper(a, b):
+    def matches(x, y):
+        return x is y or ANY in (x, y) and RUNNING not in (x, y)
+
+    wrapped_a = ProcessStateCompareWrapper(a)
+    wrapped_b = ProcessStateCompareWrapper(b)
+    assert (wrapped_a == wrapped_b) == matches(a, b)
@@ -16,6 +16,9 @@ __license__ = "BSD 3-Clause"
 from .actions import (  # noqa
     clone_git_repository,
     build_workspace,
+    restore_cached_build,
+    store_build_in_cache,
+    prefetch_singularity_image,
     store_info_file,
     store_camera_calibration_files,
     store_report,
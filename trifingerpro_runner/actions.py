@@ -3,32 +3,45 @@
 __copyright__ = "Copyright (c) 2021 Max Planck Gesellschaft"
 __license__ = "BSD 3-Clause"
 
+import concurrent.futures
+import datetime
+import hashlib
 import shutil
-import time
+import tempfile
 import socket
-import json
 import logging
 import os
 import subprocess
 import typing
 
+from . import json_utils
 from .configuration import JobConfig, OutputFiles
 
 
+#: Name of the file marking a complete entry in the build cache.
+_BUILD_CACHE_COMPLETE_MARKER = ".complete"
+
+#: Name of the host (does not change while running, so only look it up once).
+_HOSTNAME = socket.gethostname()
+
+
 def clone_git_repository(
     repository: str,
-    branch: str,
+    branch: typing.Optional[str],
     destination: str,
     git_ssh_command: typing.Optional[str] = None,
+    submodule_jobs: int = 8,
 ) -> str:
     """Clone a git repository.
 
     Args:
         repository:  The repository URL.
-        branch:  Name of the branch that is cloned.
+        branch:  Name of the branch that is cloned.  If None, the default
+            branch of the repository is cloned.
         destination:  Path to which the repository is cloned.
         git_ssh_command:  Optional.  If given, this is set to the
             $GIT_SSH_COMMAND environment variable before calling git clone.
+        submodule_jobs:  Number of submodules that are fetched in parallel.
 
     Returns:
         The hash of the current commit.
@@ -36,21 +49,29 @@ def clone_git_repository(
     logging.info(
         "Clone user git repository %s (%s)",
         repository,
-        branch,
+        branch or "default branch",
     )
 
     if git_ssh_command:
         os.environ["GIT_SSH_COMMAND"] = git_ssh_command
 
+    # Only the checked out commit is needed, so do a shallow clone to reduce
+    # the amount of data that needs to be fetched.  Setting fetchJobs via the
+    # config (instead of --jobs) also applies it to nested submodules.
     git_cmd = [
         "git",
+        "-c",
+        "submodule.fetchJobs={}".format(submodule_jobs),
         "clone",
+        "--depth",
+        "1",
+        "--single-branch",
+        "--shallow-submodules",
         "--recurse-submodules",
-        "-b",
-        branch,
-        repository,
-        destination,
     ]
+    if branch is not None:
+        git_cmd += ["-b", branch]
+    git_cmd += [repository, destination]
     try:
         subprocess.run(
             git_cmd,
@@ -66,19 +87,49 @@ def clone_git_repository(
         )
 
     # get current revision
-    git_cmd = [
-        "git",
-        "--git-dir",
-        os.path.join(destination, ".git"),
-        "rev-parse",
-        "HEAD",
-    ]
-    revision_bytes = subprocess.check_output(git_cmd)
-    git_revision = revision_bytes.decode("utf-8").strip()
+    git_revision = _read_git_head(os.path.join(destination, ".git"))
 
     return git_revision
 
 
+def _read_git_head(git_dir: str) -> str:
+    """Get the hash of the commit HEAD is pointing to.
+
+    This reads the files in the git directory directly instead of calling
+    ``git rev-parse HEAD``.
+
+    Args:
+        git_dir:  Path to the ".git" directory of the repository.
+
+    Returns:
+        The hash of the current commit.
+    """
+    with open(os.path.join(git_dir, "HEAD")) as fh:
+        head = fh.read().strip()
+
+    # in case of a detached HEAD, the file directly contains the hash
+    if not head.startswith("ref:"):
+        return head
+
+    ref = head[len("ref:") :].strip()
+    try:
+        with open(os.path.join(git_dir, ref)) as fh:
+            return fh.read().strip()
+    except FileNotFoundError:
+        pass
+
+    # the ref may also be stored in the packed-refs file
+    with open(os.path.join(git_dir, "packed-refs")) as fh:
+        for line in fh:
+            if line.startswith(("#", "^")):
+                continue
+            revision, _, name = line.strip().partition(" ")
+            if name == ref:
+                return revision
+
+    raise RuntimeError("Failed to resolve git reference {}".format(ref))
+
+
 def build_workspace(config: JobConfig, workspace_path: str):
     logging.info("Build the user code")
     build_cmd = [
@@ -86,6 +137,7 @@ def build_workspace(config: JobConfig, workspace_path: str):
         "exec",
         "--cleanenv",
         "--contain",
+        "--sif-fuse" if config.singularity_sif_fuse else None,
         "--net",
         "--network",
         "none",
@@ -96,44 +148,226 @@ def build_workspace(config: JobConfig, workspace_path: str):
         "-c",
         ". /setup.bash; cd /ws; colcon build",
     ]
-    proc = subprocess.run(
-        build_cmd,
-        check=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
+    build_cmd = [c for c in build_cmd if c is not None]
+
+    if config.compress_build_output:
+        # pipe the output through zstd (using all cores) to compress it on the
+        # fly
+        stdout_file = os.path.join(
+            config.host_output_dir, OutputFiles.build_output_compressed
+        )
+        with open(stdout_file, "wb") as fh:
+            compressor = subprocess.Popen(
+                ["zstd", "-3", "-T0", "-q", "-c"],
+                stdin=subprocess.PIPE,
+                stdout=fh,
+            )
+            try:
+                subprocess.run(
+                    build_cmd,
+                    check=True,
+                    stdout=compressor.stdin,
+                    stderr=subprocess.STDOUT,
+                )
+            finally:
+                compressor.stdin.close()
+                compressor.wait()
+
+        # otherwise the output file may be truncated or corrupt
+        if compressor.returncode != 0:
+            raise RuntimeError(
+                "Failed to compress the build output (zstd exited with"
+                " status {}).".format(compressor.returncode)
+            )
+    else:
+        # write the output directly to the output file
+        stdout_file = os.path.join(
+            config.host_output_dir, OutputFiles.build_output
+        )
+        with open(stdout_file, "wb") as fh:
+            subprocess.run(
+                build_cmd,
+                check=True,
+                stdout=fh,
+                stderr=subprocess.STDOUT,
+            )
+
+
+def _get_build_cache_entry(config: JobConfig, git_revision: str) -> str:
+    """Get the path of the build cache entry for the given revision.
+
+    The key includes the user image, as the build result depends on it as
+    well.
+    """
+    assert config.build_cache_dir
+
+    image = os.path.realpath(config.singularity_user_image)
+    image_stat = os.stat(image)
+    key = "{}:{}:{}:{}".format(
+        git_revision, image, image_stat.st_size, image_stat.st_mtime_ns
     )
 
-    # store output
-    stdout_file = os.path.join(
-        config.host_output_dir, OutputFiles.build_output
+    return os.path.join(
+        config.build_cache_dir, hashlib.sha256(key.encode()).hexdigest()
     )
-    with open(stdout_file, "wb") as fh:
-        fh.write(proc.stdout)
+
+
+def restore_cached_build(
+    config: JobConfig, git_revision: str, workspace_path: str
+) -> bool:
+    """Restore the build of the given revision from the build cache.
+
+    If ``config.build_cache_dir`` is set and contains a complete build of the
+    given revision, its install space is copied to the workspace, so that
+    building can be skipped.
+
+    Args:
+        config:  Job configuration.
+        git_revision:  Revision of the user code.
+        workspace_path:  Path to the workspace.
+
+    Returns:
+        True if a cached build was restored, False if the workspace needs to
+        be built.
+    """
+    if not config.build_cache_dir:
+        return False
+
+    entry = _get_build_cache_entry(config, git_revision)
+    if not os.path.exists(os.path.join(entry, _BUILD_CACHE_COMPLETE_MARKER)):
+        return False
+
+    logging.info("Use cached build of revision %s", git_revision)
+
+    # Copy instead of hard-linking, as the workspace is writable by the user
+    # code, which must not be able to modify the cache.
+    shutil.copytree(
+        os.path.join(entry, "install"),
+        os.path.join(workspace_path, "install"),
+        symlinks=True,
+    )
+
+    # write a note to the build output file (in the same format as it is
+    # written by build_workspace)
+    note = "Build skipped, using cached build of revision {}.\n".format(
+        git_revision
+    ).encode()
+    if config.compress_build_output:
+        stdout_file = os.path.join(
+            config.host_output_dir, OutputFiles.build_output_compressed
+        )
+        with open(stdout_file, "wb") as fh:
+            subprocess.run(
+                ["zstd", "-q", "-c"], input=note, stdout=fh, check=True
+            )
+    else:
+        stdout_file = os.path.join(
+            config.host_output_dir, OutputFiles.build_output
+        )
+        with open(stdout_file, "wb") as fh:
+            fh.write(note)
+
+    return True
+
+
+def store_build_in_cache(
+    config: JobConfig, git_revision: str, workspace_path: str
+):
+    """Store the install space of the workspace in the build cache.
+
+    Does nothing if ``config.build_cache_dir`` is not set.  Failing to store
+    the build is not considered an error, the job can continue normally.
+
+    Args:
+        config:  Job configuration.
+        git_revision:  Revision of the user code.
+        workspace_path:  Path to the workspace (must already be built).
+    """
+    if not config.build_cache_dir:
+        return
+
+    entry = _get_build_cache_entry(config, git_revision)
+    if os.path.exists(entry):
+        return
+
+    # Copy to a temporary directory first and then rename it, so that other
+    # jobs never see an incomplete entry.
+    tmp_entry = None
+    try:
+        os.makedirs(config.build_cache_dir, exist_ok=True)
+        tmp_entry = tempfile.mkdtemp(
+            prefix=".tmp-", dir=config.build_cache_dir
+        )
+        shutil.copytree(
+            os.path.join(workspace_path, "install"),
+            os.path.join(tmp_entry, "install"),
+            symlinks=True,
+        )
+        marker_file = os.path.join(tmp_entry, _BUILD_CACHE_COMPLETE_MARKER)
+        open(marker_file, "w").close()
+        os.rename(tmp_entry, entry)
+    except OSError as e:
+        logging.warning("Failed to store build in cache: %s", e)
+        if tmp_entry:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+
+
+def prefetch_singularity_image(image: str):
+    """Ask the kernel to load the given Singularity image into the page cache.
+
+    This only gives an advice to the kernel and returns immediately.  It can
+    be used to warm up the cache while other preparation steps are running,
+    so that starting the containers later does not need to wait for the image
+    to be read from disk.
+
+    Args:
+        image:  Path to the Singularity image file.
+    """
+    fd = os.open(image, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    finally:
+        os.close(fd)
 
 
 def store_info_file(config: JobConfig, git_revision: str):
     """Store some information about this submission into a file."""
     info = {
         "git_revision": git_revision,
-        "robot_name": socket.gethostname(),
-        "timestamp": time.asctime(),
+        "robot_name": _HOSTNAME,
+        "timestamp": datetime.datetime.now(
+            tz=datetime.timezone.utc
+        ).isoformat(),
     }
     info_file = os.path.join(config.host_output_dir, OutputFiles.meta_info)
-    with open(info_file, "w") as fh:
-        json.dump(info, fh, indent=4)
+    json_utils.dump(info, info_file)
 
 
 def store_camera_calibration_files(config: JobConfig):
     """Copy the camera calibration files to the output directory."""
-    for camera_id in (60, 180, 300):
-        src = "/etc/trifingerpro/camera{}_cropped_and_downsampled.yml".format(
+    camera_ids = (60, 180, 300)
+    sources = [
+        "/etc/trifingerpro/camera{}_cropped_and_downsampled.yml".format(
             camera_id
         )
-        dest = os.path.join(
+        for camera_id in camera_ids
+    ]
+    destinations = [
+        os.path.join(
             config.host_output_dir,
             OutputFiles.camera_info.format(camera_id=camera_id),
         )
-        shutil.copyfile(src, dest)
+        for camera_id in camera_ids
+    ]
+
+    # The copies are independent of each other, so run them concurrently
+    # (shutil.copyfile uses sendfile internally, so the data is not copied
+    # through user space).
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=len(camera_ids)
+    ) as executor:
+        # consume the results to propagate errors
+        list(executor.map(shutil.copyfile, sources, destinations))
 
 
 def store_report(
@@ -155,5 +389,4 @@ def store_report(
         report["user_returncode"] = user_returncode
 
     report_file = os.path.join(config.host_output_dir, OutputFiles.report)
-    with open(report_file, "w") as fh:
-        json.dump(report, fh, indent=4)
+    json_utils.dump(report, report_file)
@@ -3,26 +3,20 @@
 __copyright__ = "Copyright (c) 2021 Max Planck Gesellschaft"
 __license__ = "BSD 3-Clause"
 
-import signal
 import logging
-import os
 import subprocess
 
 from .configuration import JobConfig, Task
+from .process_runner import ProcessRunner
 
 
-class BaseBackendRunner:
+class BaseBackendRunner(ProcessRunner):
     #: Timeout for the backend to get ready after being started.
     READY_TIMEOUT_SEC = 60
 
-    returncode: int
-
     def start(self, first_action_timeout: int):
         raise NotImplementedError()
 
-    def is_running(self) -> bool:
-        raise NotImplementedError()
-
 
 class BackendRunner(BaseBackendRunner):
     def __init__(self, config: JobConfig, logger=logging):
@@ -38,70 +32,59 @@ class BackendRunner(BaseBackendRunner):
         else:
             camera_flag = "--cameras"
 
-        backend_rosrun_cmd = " ".join(
-            [
-                "ros2 run robot_fingers trifinger_robot_backend",
-                camera_flag,
-                "--first-action-timeout {}".format(first_action_timeout),
-                "--max-number-of-actions {}".format(
-                    self.config.episode_length
+        backend_rosrun_cmd = [
+            "ros2",
+            "run",
+            "robot_fingers",
+            "trifinger_robot_backend",
+            camera_flag,
+            "--first-action-timeout",
+            str(first_action_timeout),
+            "--max-number-of-actions",
+            str(self.config.episode_length),
+            "--fail-on-incomplete-run",
+        ]
+
+        if self.config.singularity_backend_instance:
+            # Run in the already running instance.  This skips the container
+            # setup, so it is much faster.  Note that the instance needs to be
+            # started with the same options and bindings as used below.
+            # --cleanenv given to "instance start" only applies to the
+            # instance's own process, so it has to be passed again here.
+            run_backend_cmd = [
+                self.config.singularity_binary,
+                "run",
+                "--cleanenv",
+                "instance://{}".format(
+                    self.config.singularity_backend_instance
                 ),
-                "--fail-on-incomplete-run",
+                *backend_rosrun_cmd,
+            ]
+        else:
+            bindings = [
+                *self.config.device_bindings,
+                "/etc/trifingerpro:/etc/trifingerpro:ro",
+                "/var/log/trifinger:/log",
             ]
-        )
 
-        bindings = [
-            "/dev",
-            "/etc/trifingerpro:/etc/trifingerpro:ro",
-            "/var/log/trifinger:/log",
-        ]
+            run_backend_cmd = [
+                self.config.singularity_binary,
+                "run",
+                "--cleanenv",
+                "--contain",
+                "--sif-fuse" if self.config.singularity_sif_fuse else None,
+                "-B",
+                ",".join(bindings),
+                self.config.singularity_backend_image,
+                *backend_rosrun_cmd,
+            ]
+            run_backend_cmd = [c for c in run_backend_cmd if c is not None]
 
-        run_backend_cmd = [
-            self.config.singularity_binary,
-            "run",
-            "--cleanenv",
-            "--contain",
-            "-B",
-            ",".join(bindings),
-            self.config.singularity_backend_image,
-            backend_rosrun_cmd,
-        ]
         self.logger.debug(" ".join(run_backend_cmd))
-        self._proc = subprocess.Popen(
+        self._start_process(
             run_backend_cmd, start_new_session=True, stderr=subprocess.STDOUT
         )
 
-    def is_running(self):
-        self.returncode = self._proc.poll()
-        return self.returncode is None
-
-    # FIXME not used anymore?
-    def kill(self):
-        self.logger.info("Backend still running.  Send SIGINT.")
-        # the backend spawns several subprocesses by itself, so kill the whole
-        # process group instead of just the main process (otherwise some
-        # processes will keep running in the backgound).
-        backend_pgid = os.getpgid(self._proc.pid)
-        os.killpg(backend_pgid, signal.SIGINT)
-        try:
-            self.returncode = self._proc.wait(10)
-        except subprocess.TimeoutExpired:
-            self.logger.warning("Backend still running.  Send SIGTERM.")
-            try:
-                os.killpg(backend_pgid, signal.SIGTERM)
-                self.returncode = self._proc.wait(3)
-            except subprocess.TimeoutExpired:
-                self.logger.error("Backend still running.  Send SIGKILL.")
-                # FIXME this does not seem to kill everything, the pybullet gui
-                # is still running when this script terminates...
-                os.killpg(backend_pgid, signal.SIGKILL)
-                self.returncode = self._proc.wait()
-
-        self.logger.info(
-            "Backend process terminated with returncode %d.", self.returncode
-        )
-        return self.returncode == 0
-
 
 class SimulationBackendRunner(BaseBackendRunner):
     def __init__(self, config: JobConfig, logger=logging):
@@ -118,20 +101,21 @@ class SimulationBackendRunner(BaseBackendRunner):
         elif self.config.task == Task.REARRANGE_DICE:
             object_type = "dice"
 
-        backend_rosrun_cmd = " ".join(
-            [
-                "ros2 run robot_fingers pybullet_backend",
-                "--cameras",
-                "--render-images" if self.config.sim_render_images else "",
-                "--object={}".format(object_type),
-                "--real-time-mode",
-                "--visualize" if self.config.sim_visualize else "",
-                "--max-number-of-actions={}".format(
-                    self.config.episode_length
-                ),
-                "--first-action-timeout={}".format(first_action_timeout),
-            ]
-        )
+        backend_rosrun_cmd = [
+            "ros2",
+            "run",
+            "robot_fingers",
+            "pybullet_backend",
+            "--cameras",
+            "--object={}".format(object_type),
+            "--real-time-mode",
+            "--max-number-of-actions={}".format(self.config.episode_length),
+            "--first-action-timeout={}".format(first_action_timeout),
+        ]
+        if self.config.sim_render_images:
+            backend_rosrun_cmd.append("--render-images")
+        if self.config.sim_visualize:
+            backend_rosrun_cmd.append("--visualize")
 
         run_backend_cmd = [
             self.config.singularity_binary,
@@ -139,23 +123,17 @@ class SimulationBackendRunner(BaseBackendRunner):
             "--cleanenv",
             "--contain",
             "--nv" if self.config.singularity_nv else None,
+            "--sif-fuse" if self.config.singularity_sif_fuse else None,
             "-B",
-            "/dev",
+            ",".join(self.config.device_bindings),
             self.config.singularity_backend_image,
-            backend_rosrun_cmd,
+            *backend_rosrun_cmd,
         ]
 
-        run_backend_cmd = [c for c in run_backend_cmd
-                           if c is not None]
-        
+        run_backend_cmd = [c for c in run_backend_cmd if c is not None]
+
         self.logger.debug(" ".join(run_backend_cmd))
-        self._proc = subprocess.Popen(
-            run_backend_cmd, stderr=subprocess.STDOUT
-        )
-        
-    def is_running(self):
-        self.returncode = self._proc.poll()
-        return self.returncode is None
+        self._start_process(run_backend_cmd, stderr=subprocess.STDOUT)
 
 
 class LogReplayBackendRunner(BaseBackendRunner):
@@ -166,30 +144,31 @@ class LogReplayBackendRunner(BaseBackendRunner):
     def start(self, first_action_timeout: int):
         self.logger.info("Start the log replay backend")
 
-        backend_rosrun_cmd = " ".join(
-            [
-                "ros2 run robot_fingers log_replay_backend",
-                "--robot-log-file TODO",
-                "--camera-log-file TODO",
-                "--first-action-timeout {}".format(first_action_timeout),
-            ]
-        )
+        backend_rosrun_cmd = [
+            "ros2",
+            "run",
+            "robot_fingers",
+            "log_replay_backend",
+            "--robot-log-file",
+            "TODO",
+            "--camera-log-file",
+            "TODO",
+            "--first-action-timeout",
+            str(first_action_timeout),
+        ]
 
         run_backend_cmd = [
             self.config.singularity_binary,
             "run",
             "--cleanenv",
             "--contain",
+            "--sif-fuse" if self.config.singularity_sif_fuse else None,
             "-B",
-            "/dev",
+            ",".join(self.config.device_bindings),
             self.config.singularity_backend_image,
-            backend_rosrun_cmd,
+            *backend_rosrun_cmd,
         ]
-        self.logger.debug(" ".join(run_backend_cmd))
-        self._proc = subprocess.Popen(
-            run_backend_cmd, stderr=subprocess.STDOUT
-        )
+        run_backend_cmd = [c for c in run_backend_cmd if c is not None]
 
-    def is_running(self):
-        self.returncode = self._proc.poll()
-        return self.returncode is None
+        self.logger.debug(" ".join(run_backend_cmd))
+        self._start_process(run_backend_cmd, stderr=subprocess.STDOUT)
@@ -4,7 +4,6 @@ __copyright__ = "Copyright (c) 2021 Max Planck Gesellschaft"
 __license__ = "BSD 3-Clause"
 
 import os
-import re
 
 
 def is_condor_running() -> bool:
@@ -18,10 +17,9 @@ def get_condor_job_id() -> str:
 
     # The given job_id is something like "sched#12345.0".  Cut out the actual
     # ID (the number between # and .)
-    match = re.search(r"#([0-9]*)\.", job_id)
-    if match:
-        job_id = match.group(1)
-    else:
+    _, hash_sep, tail = job_id.partition("#")
+    number, dot_sep, _ = tail.partition(".")
+    if not (hash_sep and dot_sep and number.isdigit()):
         raise RuntimeError("Failed to parse $JOB_ID: '{}'".format(job_id))
 
-    return job_id
+    return number
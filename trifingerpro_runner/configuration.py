@@ -2,14 +2,16 @@ __copyright__ = "Copyright (c) 2021 Max Planck Gesellschaft"
 __license__ = "BSD 3-Clause"
 
 import argparse
+import dataclasses
 import enum
 import typing
 import os
 import logging
-import json
 import getpass
+import pathlib
 
 from . import condor
+from . import json_utils
 
 
 # max. allowed number of steps in one run
@@ -30,6 +32,7 @@ class OutputFiles:
     report = "report.json"
 
     build_output = "build_output.txt"
+    build_output_compressed = "build_output.txt.zst"
 
     user_stdout = "user_stdout.txt"
     user_stderr = "user_stderr.txt"
@@ -55,8 +58,24 @@ class Task(enum.Enum):
         """Check whether the task requires object tracking to be enabled."""
         return self in [self.MOVE_CUBE, self.MOVE_CUBE_ON_TRAJECTORY]
 
+    def goal_config_is_deterministic(self, goal_config: typing.Any) -> bool:
+        """Check if the goal computed from the given goal config is fixed.
 
-class JobConfig(typing.NamedTuple):
+        For all tasks, ``goal_from_config`` only uses the goal given in the
+        "goal" entry of the config.  If it is not set, a random goal is sampled
+        (for MOVE_CUBE with the difficulty given in the config).
+
+        Args:
+            goal_config: The parsed content of the goal config file.
+        """
+        if self is self.NONE:
+            return False
+
+        return isinstance(goal_config, dict) and "goal" in goal_config
+
+
+@dataclasses.dataclass(frozen=True)
+class JobConfig:
     #: Path to the singularity image used to run the back end.
     singularity_backend_image: str
 
@@ -68,17 +87,44 @@ class JobConfig(typing.NamedTuple):
 
     #: URL of the git repository.
     git_repository: str
-    #: Name of the branch that is used.
-    git_branch: str = "master"
+    #: Name of the branch that is used.  If None, the default branch of the
+    #: repository is used.
+    git_branch: typing.Optional[str] = "master"
     git_ssh_command: typing.Optional[str] = None
+    #: Number of git submodules that are fetched in parallel when cloning.
+    git_submodule_jobs: int = 8
 
     #: The singularity binary
     singularity_binary: str = "singularity"
 
+    #: Name of a running Singularity instance of the backend image.  If set,
+    #: the robot backend is executed in this instance instead of starting a
+    #: new container (see README).
+    singularity_backend_instance: typing.Optional[str] = None
+
+    #: Device paths that are bound into the containers of the backend and data
+    #: nodes.  By default all of /dev is bound, this can be restricted to the
+    #: devices that are actually needed to reduce the container setup work.
+    #: Not used for the backend if it runs in ``singularity_backend_instance``.
+    device_bindings: typing.Tuple[str, ...] = ("/dev",)
+
     #: Directory on the host that is bound to the container when running the
     #: user code.
     host_user_data_dir: typing.Optional[str] = None
 
+    #: Directory in which builds of the user code are cached (keyed by git
+    #: revision and user image).  If not set, the user code is always built.
+    build_cache_dir: typing.Optional[str] = None
+    #: If true, the build output is compressed with zstd (requires the zstd
+    #: executable).
+    compress_build_output: bool = False
+
+    #: Directory in which goals computed from a goal config are cached (keyed
+    #: by goal config, task and backend image).  It must not be writable by
+    #: the user code, as cached goals are used without recomputing them.  If
+    #: not set, the goal is always computed.
+    goal_cache_dir: typing.Optional[str] = None
+
     #: Number of actions that the robot executes in one run.  After this, the
     #: backend shuts down automatically.
     episode_length: int = DEFAULT_EPISODE_LENGTH
@@ -93,6 +139,24 @@ class JobConfig(typing.NamedTuple):
     sim_render_images: bool = False
     #: If true, pass --nv to singularity when running the simulation backend.
     singularity_nv: bool = False
+    #: If true, pass --sif-fuse to singularity so that the image is mounted
+    #: via FUSE and only the parts that are actually accessed are read.
+    singularity_sif_fuse: bool = False
+
+
+def _parse_device_bindings(device_bindings: str) -> typing.Tuple[str, ...]:
+    """Parse the comma-separated list given to ``--device-bindings``."""
+    bindings = tuple(b for b in device_bindings.split(",") if b)
+
+    # The nodes communicate via shared memory, but with --contain /dev/shm is
+    # only available if all of /dev is bound.
+    if "/dev" not in bindings:
+        logging.warning(
+            "/dev is not bound into the containers of the backend and data"
+            " nodes, so /dev/shm is not available there."
+        )
+
+    return bindings
 
 
 def make_submission_system_config():
@@ -106,6 +170,29 @@ def make_submission_system_config():
         required=True,
         help="Path to the Singularity image for the backend.",
     )
+    parser.add_argument(
+        "--backend-instance",
+        type=str,
+        help="""Name of a running Singularity instance of the backend image in
+            which the robot backend is executed.  If not set, a new container
+            is started.""",
+    )
+    parser.add_argument(
+        "--device-bindings",
+        type=str,
+        help="""Comma-separated list of device paths that are bound into the
+            containers of the backend and data nodes (default: /dev).  Note
+            that /dev/shm is only available if all of /dev is bound.  Cannot
+            be combined with --backend-instance, as the bindings of the
+            instance are set when it is started.
+        """,
+    )
+    parser.add_argument(
+        "--goal-cache-dir",
+        type=str,
+        help="""If set, goals computed from a goal config are cached in this
+            directory.  It must not be writable by the user code.""",
+    )
     parser.add_argument(
         "--task",
         type=str,
@@ -117,6 +204,12 @@ def make_submission_system_config():
     )
     args = parser.parse_args()
 
+    if args.backend_instance and args.device_bindings:
+        parser.error(
+            "--device-bindings cannot be combined with --backend-instance"
+        )
+    device_bindings = _parse_device_bindings(args.device_bindings or "/dev")
+
     if not os.path.exists(args.backend_image):
         raise FileNotFoundError(
             "Backend Singularity image {} does not exist".format(
@@ -131,28 +224,28 @@ def make_submission_system_config():
         condor.get_condor_job_id(),
     )
 
-    # The "host_output_dir" contains the unique job id, so if it already
-    # exists, something is wrong.
-    if os.path.exists(host_output_dir):
+    # create job-specific "host_output_dir".  It contains the unique job id,
+    # so if it already exists, something is wrong.
+    try:
+        os.mkdir(host_output_dir)
+    except FileExistsError:
         raise RuntimeError(
             "Output directory {} already exists".format(host_output_dir)
         )
 
-    # create job-specific "host_output_dir"
-    os.mkdir(host_output_dir)
+    # directory in the user's home which contains the user config and other
+    # files provided by the user
+    payload_dir = pathlib.Path("~", "payload").expanduser()
 
     # load user config
-    user_config_file = os.path.expanduser(
-        os.path.join("~", "payload", _userconf)
-    )
-    with open(user_config_file) as fh:
-        user_config = json.load(fh)
+    user_config_file = str(payload_dir / _userconf)
+    user_config = json_utils.load(user_config_file)
 
     # Check if user configured custom user image.  If not, use the backend
     # image.
     try:
-        singularity_user_image = os.path.expanduser(
-            os.path.join("~", "payload", user_config["singularity_image"])
+        singularity_user_image = str(
+            payload_dir / user_config["singularity_image"]
         )
     except KeyError:
         singularity_user_image = args.backend_image
@@ -168,9 +261,7 @@ def make_submission_system_config():
 
     # If configured, use the "git_deploy_key" for git commands.
     try:
-        user_key = os.path.expanduser(
-            os.path.join("~", "payload", user_config["git_deploy_key"])
-        )
+        user_key = str(payload_dir / user_config["git_deploy_key"])
         git_ssh_command = "ssh -i {} -o StrictHostKeyChecking=no".format(
             user_key
         )
@@ -179,7 +270,7 @@ def make_submission_system_config():
 
     # directory from the user home that is bound into the container (can be
     # used to provide files that are too large for git)
-    host_user_data_dir = os.path.expanduser(os.path.join("~", "payload"))
+    host_user_data_dir = str(payload_dir)
 
     # make sure the episode length does not exceed the allowed maximum
     episode_length = user_config.get("episode_length", DEFAULT_EPISODE_LENGTH)
@@ -188,12 +279,15 @@ def make_submission_system_config():
     config = JobConfig(
         singularity_binary="singularity",
         singularity_backend_image=args.backend_image,
+        singularity_backend_instance=args.backend_instance,
+        device_bindings=device_bindings,
         singularity_user_image=singularity_user_image,
         host_output_dir=host_output_dir,
         git_repository=user_config["repository"],
         git_branch=user_config.get("branch", "master"),
         git_ssh_command=git_ssh_command,
         host_user_data_dir=host_user_data_dir,
+        goal_cache_dir=args.goal_cache_dir,
         episode_length=episode_length,
         task=Task[args.task],
     )
@@ -242,6 +336,33 @@ def make_local_execution_config():
         type=str,
         help="If set, bind this to '/userhome' when running the user code.",
     )
+    parser.add_argument(
+        "--device-bindings",
+        type=str,
+        default="/dev",
+        help="""Comma-separated list of device paths that are bound into the
+            containers of the backend and data nodes (default: %(default)s).
+            Note that /dev/shm is only available if all of /dev is bound.
+        """,
+    )
+    parser.add_argument(
+        "--build-cache-dir",
+        type=str,
+        help="""If set, builds of the user code are cached in this directory
+            and reused when the same revision is executed again.""",
+    )
+    parser.add_argument(
+        "--compress-build-output",
+        action="store_true",
+        help="""Compress the build output with zstd (requires the zstd
+            executable).""",
+    )
+    parser.add_argument(
+        "--goal-cache-dir",
+        type=str,
+        help="""If set, goals computed from a goal config are cached in this
+            directory.  It must not be writable by the user code.""",
+    )
     parser.add_argument(
         "--episode-length",
         type=int,
@@ -276,6 +397,14 @@ def make_local_execution_config():
             This is needed when running on a machine that uses Nvidia drivers.
         """,
     )
+    parser.add_argument(
+        "--singularity-sif-fuse",
+        action="store_true",
+        help="""Run Singularity containers with --sif-fuse, i.e. mount the
+            images via FUSE instead of extracting them.  Requires a Singularity
+            version with FUSE support.
+        """,
+    )
     args = parser.parse_args()
 
     singularity_backend_image = os.path.abspath(args.backend_image)
@@ -301,11 +430,16 @@ def make_local_execution_config():
         git_repository=args.repository,
         git_branch=args.branch,
         host_user_data_dir=args.user_data_dir,
+        device_bindings=_parse_device_bindings(args.device_bindings),
+        build_cache_dir=args.build_cache_dir,
+        compress_build_output=args.compress_build_output,
+        goal_cache_dir=args.goal_cache_dir,
         episode_length=episode_length,
         task=Task[args.task],
         sim_visualize=args.sim_visualize,
         sim_render_images=args.sim_render_images,
         singularity_nv=args.singularity_nv,
+        singularity_sif_fuse=args.singularity_sif_fuse,
     )
 
     return config
@@ -5,9 +5,10 @@ import logging
 import subprocess
 
 from .configuration import JobConfig, OutputFiles
+from .process_runner import ProcessRunner
 
 
-class DataRunner:
+class DataRunner(ProcessRunner):
 
     #: Timeout for the data node to get ready after being started.
     READY_TIMEOUT_SEC = 60
@@ -25,35 +26,40 @@ class DataRunner:
         else:
             camera_flag = "--cameras"
 
-        rosrun_cmd = " ".join(
-            [
-                "ros2 run robot_fingers trifinger_data_backend",
-                camera_flag,
-                "--robot-logfile /output/{}".format(OutputFiles.robot_data),
-                "--camera-logfile /output/{}".format(OutputFiles.camera_data),
-                "--max-number-of-actions {}".format(
-                    self.config.episode_length
-                ),
-            ]
-        )
+        rosrun_cmd = [
+            "ros2",
+            "run",
+            "robot_fingers",
+            "trifinger_data_backend",
+            camera_flag,
+            "--robot-logfile",
+            "/output/{}".format(OutputFiles.robot_data),
+            "--camera-logfile",
+            "/output/{}".format(OutputFiles.camera_data),
+            "--max-number-of-actions",
+            str(self.config.episode_length),
+        ]
 
         singularity_cmd = [
             self.config.singularity_binary,
             "run",
             "--cleanenv",
             "--contain",
+            "--sif-fuse" if self.config.singularity_sif_fuse else None,
             "-B",
-            "/dev,/etc/trifingerpro,{}:/output".format(
-                self.config.host_output_dir
+            ",".join(
+                [
+                    *self.config.device_bindings,
+                    "/etc/trifingerpro",
+                    "{}:/output".format(self.config.host_output_dir),
+                ]
             ),
             self.config.singularity_backend_image,
-            rosrun_cmd,
+            *rosrun_cmd,
         ]
+        singularity_cmd = [c for c in singularity_cmd if c is not None]
+
         self.logger.debug(" ".join(singularity_cmd))
-        self._proc = subprocess.Popen(
+        self._start_process(
             singularity_cmd, start_new_session=True, stderr=subprocess.STDOUT
         )
-
-    def is_running(self):
-        self.returncode = self._proc.poll()
-        return self.returncode is None
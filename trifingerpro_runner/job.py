@@ -0,0 +1,230 @@
+"""Parts of a job that do not depend on ROS.
+
+This includes the preparation steps that are executed before the nodes are
+started.
+"""
+
+__copyright__ = "Copyright (c) 2021 Max Planck Gesellschaft"
+__license__ = "BSD 3-Clause"
+
+import enum
+import hashlib
+import logging
+import os
+import pathlib
+import subprocess
+import typing
+
+from . import actions
+from . import configuration
+from . import json_utils
+
+
+class NodeTimeoutError(Exception):
+    """Error indicating that a node timed out."""
+
+    pass
+
+
+class NodeUnexpectedTerminationError(Exception):
+    """Error indicating that a node terminated unexpectedly."""
+
+    pass
+
+
+class BackendType(enum.Enum):
+    """Different types of robot back end that can be used."""
+
+    ROBOT = 1
+    SIMULATION = 2
+    LOG_REPLAY = 3
+
+
+def clone_user_repository(
+    config: configuration.JobConfig, source_path: str
+) -> str:
+    """Clone the user repository.
+
+    Args:
+        config: Configuration specifying the git repository, branch, etc.
+        source_path: Path to which the repository is cloned.
+
+    Returns:
+        The git revision of the cloned repository.
+    """
+    git_revision = actions.clone_git_repository(
+        repository=config.git_repository,
+        branch=config.git_branch,
+        destination=os.path.join(source_path, "usercode"),
+        git_ssh_command=config.git_ssh_command,
+        submodule_jobs=config.git_submodule_jobs,
+    )
+
+    return git_revision
+
+
+def build_user_code(
+    config: configuration.JobConfig, git_revision: str, ws_dir: str
+):
+    """Build the user code (unless there is a cached build of this revision).
+
+    Args:
+        config: Job configuration.
+        git_revision: Revision of the user code.
+        ws_dir: Path to the workspace.
+    """
+    if not actions.restore_cached_build(config, git_revision, ws_dir):
+        actions.build_workspace(config, ws_dir)
+        actions.store_build_in_cache(config, git_revision, ws_dir)
+
+
+def _get_goal_cache_file(
+    config: configuration.JobConfig, goal_file: pathlib.Path
+) -> typing.Optional[pathlib.Path]:
+    """Get path of the goal cache file for the given goal config.
+
+    The key includes task and backend image, as they determine how the goal
+    is computed from the config.
+
+    Returns:
+        The path of the cache file or None if the goal must not be cached
+        (caching is disabled or the goal config leaves parts of the goal to
+        be sampled).
+    """
+    if not config.goal_cache_dir:
+        return None
+
+    goal_config = goal_file.read_bytes()
+    try:
+        is_deterministic = config.task.goal_config_is_deterministic(
+            json_utils.loads(goal_config)
+        )
+    except ValueError:
+        # let the task report the error in the goal config
+        is_deterministic = False
+    if not is_deterministic:
+        return None
+
+    image = config.singularity_backend_image
+    key = hashlib.sha256()
+    key.update(
+        "{}:{}:{}:".format(
+            config.task.name, image, os.stat(image).st_mtime_ns
+        ).encode()
+    )
+    key.update(goal_config)
+
+    return pathlib.Path(config.goal_cache_dir, key.hexdigest())
+
+
+def _read_cached_goal(cache_file: pathlib.Path) -> typing.Optional[str]:
+    """Read a goal from the goal cache.
+
+    Returns:
+        The JSON-encoded goal or None if there is no valid cache entry.
+    """
+    try:
+        goal_json = cache_file.read_text()
+        json_utils.loads(goal_json)
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        logging.warning("Ignore invalid goal cache entry %s", cache_file)
+        return None
+
+    return goal_json
+
+
+def _store_cached_goal(cache_file: pathlib.Path, goal_json: str):
+    """Store a goal in the goal cache.
+
+    Failing to store the goal is not considered an error.
+    """
+    # write to a temporary file first, so that concurrent jobs never read an
+    # incomplete file
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = cache_file.with_name(
+            "{}.tmp{}".format(cache_file.name, os.getpid())
+        )
+        tmp_file.write_text(goal_json)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        logging.warning("Failed to store goal in cache: %s", e)
+
+
+def json_goal_from_goal_config(
+    config: configuration.JobConfig,
+    source_path: str,
+) -> str:
+    """Get a goal based on the users goal.json
+
+    If ``config.goal_cache_dir`` is set, goals computed from a goal.json are
+    cached there, so the container does not need to be run again when the
+    same goal config is used again.  This is only done if the goal config
+    fully specifies the goal (see
+    :meth:`~.configuration.Task.goal_config_is_deterministic`), sampled goals
+    are never cached.
+
+    Args:
+        config: Configuration containing information about which Singularity
+            image to use.
+        source_path: Path to the workspace source to find the goal.json in the
+            user's repository.
+
+    Returns:
+        The JSON-encoded goal as string.
+    """
+    if config.task is configuration.Task.NONE:
+        return ""
+
+    task = config.task.name.lower()
+
+    goal_file = pathlib.Path(
+        source_path, "usercode", configuration.OutputFiles.goal
+    )
+
+    cache_file = None
+    if goal_file.is_file():
+        cache_file = _get_goal_cache_file(config, goal_file)
+        if cache_file:
+            goal_json = _read_cached_goal(cache_file)
+            if goal_json is not None:
+                return goal_json
+
+        cmd = ["goal_from_config", str(goal_file)]
+    else:
+        # If no goal file is given, simply sample a goal
+        cmd = ["sample_goal"]
+
+    run_cmd = [
+        config.singularity_binary,
+        "run",
+        "-eC",
+        "--sif-fuse" if config.singularity_sif_fuse else None,
+        "-B",
+        "{0}:{0}:ro".format(source_path),
+        config.singularity_backend_image,
+        "python3",
+        "-m",
+        "trifinger_simulation.tasks.{}".format(task),
+        *cmd,
+    ]
+    run_cmd = [c for c in run_cmd if c is not None]
+
+    try:
+        output_bytes = subprocess.check_output(run_cmd)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(e.stdout.decode("utf-8"))
+
+    # convert bytes to string
+    output = output_bytes.decode("utf-8")
+
+    goal_json = output.strip()
+    if not goal_json:
+        raise RuntimeError("Failed to sample goal.")
+
+    if cache_file:
+        _store_cached_goal(cache_file, goal_json)
+
+    return goal_json
@@ -0,0 +1,47 @@
+"""Reading and writing of JSON files.
+
+Uses orjson if it is installed and falls back to the json module of the
+standard library otherwise.
+"""
+
+__copyright__ = "Copyright (c) 2021 Max Planck Gesellschaft"
+__license__ = "BSD 3-Clause"
+
+import typing
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+    import json
+
+
+def load(filename: str) -> typing.Any:
+    """Load data from a JSON file."""
+    with open(filename, "rb") as fh:
+        if orjson is not None:
+            return orjson.loads(fh.read())
+        else:
+            return json.load(fh)
+
+
+def loads(data: typing.Union[str, bytes]) -> typing.Any:
+    """Load data from a JSON string.
+
+    Raises:
+        ValueError: If the string is not valid JSON.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    else:
+        return json.loads(data)
+
+
+def dump(data: typing.Any, filename: str):
+    """Write data to a JSON file (using indentation of 2 spaces)."""
+    if orjson is not None:
+        with open(filename, "wb") as fh:
+            fh.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    else:
+        with open(filename, "w") as fh:
+            json.dump(data, fh, indent=2)
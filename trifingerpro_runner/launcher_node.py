@@ -0,0 +1,460 @@
+"""ROS node that launches and monitors the nodes of a job."""
+
+__copyright__ = "Copyright (c) 2021 Max Planck Gesellschaft"
+__license__ = "BSD 3-Clause"
+
+import concurrent.futures
+import functools
+import os
+import threading
+import time
+import typing
+
+# ROS imports
+import rclpy
+import rclpy.executors
+import rclpy.node
+import rclpy.qos
+from std_msgs.msg import String
+from std_srvs.srv import Empty
+
+from . import actions
+from . import configuration
+from . import DataRunner, UserCodeRunner
+from .process_runner import ExitWatcher
+from .states import (
+    ProcessState,
+    MonitorAction,
+    LAUNCHER_STATES,
+    STATE_TRANSITIONS,
+)
+from .backend_runner import (
+    BaseBackendRunner,
+    BackendRunner,
+    SimulationBackendRunner,
+    LogReplayBackendRunner,
+)
+from .job import (
+    BackendType,
+    NodeTimeoutError,
+    NodeUnexpectedTerminationError,
+    build_user_code,
+    clone_user_repository,
+    json_goal_from_goal_config,
+)
+
+
+#: Time out for the first action to arrive after the robot back end is started.
+FIRST_ACTION_TIMEOUT_S = 2 * 60
+
+#: Interval in which it is checked if a node terminated while waiting for it
+#: to be ready.
+READY_CHECK_INTERVAL_S = 0.5
+
+#: Time given to the user code to terminate by itself after the robot back end
+#: terminated.
+USER_GRACE_TIME_S = 10
+
+#: Maximum time to wait for a node to terminate right after asking it to shut
+#: down.
+SHUTDOWN_WAIT_S = 3
+
+
+# some helper types for type hints
+Runner = typing.Union[DataRunner, BaseBackendRunner, UserCodeRunner]
+
+
+class TrifingerLauncherNode(rclpy.node.Node):
+    """Launch, monitor and shutdown all parts of the TriFinger software.
+
+
+    Starts data backend, robot backend and user code in the proper order
+    monitors them and, when on of them terminates, shuts down the others in the
+    proper order.
+
+    Uses ROS topics/services for communication with the backend nodes.
+
+    Args:
+        name: Name of the ROS node.
+    """
+
+    STATUS_MSG_READY = "READY"
+
+    def __init__(self, name: str):
+        super().__init__(name)
+
+        # set by the status callbacks when the nodes report to be ready
+        self.data_node_ready = threading.Event()
+        self.backend_node_ready = threading.Event()
+
+        # Quality of service profile for subscribers to ensure messages are not
+        # missed.  Only the latest status message is of interest, so a depth
+        # of 1 is enough (thanks to TRANSIENT_LOCAL it is still received when
+        # it was published before subscribing).
+        # Note: Names are a bit ugly here for ROS Dashing.  This will need be
+        # nicer in Foxy.
+        QoSDurability = rclpy.qos.QoSDurabilityPolicy
+        QoSHistory = rclpy.qos.QoSHistoryPolicy
+        QoSReliability = rclpy.qos.QoSReliabilityPolicy
+        qos_profile = rclpy.qos.QoSProfile(
+            depth=1,
+            durability=QoSDurability.RMW_QOS_POLICY_DURABILITY_TRANSIENT_LOCAL,
+            history=QoSHistory.RMW_QOS_POLICY_HISTORY_KEEP_LAST,
+            reliability=QoSReliability.RMW_QOS_POLICY_RELIABILITY_RELIABLE,
+        )
+
+        self._sub_data_node_status = self.create_subscription(
+            String,
+            "/trifinger_data/status",
+            functools.partial(
+                self._node_status_callback, "Data", self.data_node_ready
+            ),
+            qos_profile,
+        )
+        self._sub_data_node_status  # prevent unused variable warning
+
+        self._sub_backend_node_status = self.create_subscription(
+            String,
+            "/trifinger_backend/status",
+            functools.partial(
+                self._node_status_callback, "Backend", self.backend_node_ready
+            ),
+            qos_profile,
+        )
+        self._sub_backend_node_status  # prevent unused variable warning
+
+        self.data_shutdown = self.create_client(
+            Empty, "/trifinger_data/shutdown"
+        )
+        self.backend_shutdown = self.create_client(
+            Empty, "/trifinger_backend/shutdown"
+        )
+
+    def _node_status_callback(
+        self, node_name: str, ready_event: threading.Event, msg: String
+    ):
+        """Callback for the status topics of the data and back end nodes.
+
+        Args:
+            node_name: Name of the node (used for logging).
+            ready_event: Event that is set when the node reports to be ready.
+            msg: The status message.
+        """
+        if msg.data == self.STATUS_MSG_READY and not ready_event.is_set():
+            ready_event.set()
+            self.get_logger().info("{} node is ready".format(node_name))
+
+    def _wait_until_node_is_ready(
+        self,
+        runner: typing.Union[DataRunner, BaseBackendRunner],
+        ready_event: threading.Event,
+    ):
+        """Wait until the node started by runner is ready.
+
+        Waits until ``ready_event`` is set (this requires the node to be spun
+        in the background, see :meth:`_start_spinning`).  If the node
+        terminates before that or if the timeout configured for the runner
+        expires an error is raised.
+
+        Args:
+            runner: Runner class for either the data or the robot node.
+            ready_event: Event that is set when the corresponding node
+                reported that it is ready.
+
+        Raises:
+            NodeUnexpectedTerminationError: If the node started by runner
+                terminates before reporting its readiness.
+            NodeTimeoutError: If the timeout configured in runner expires
+                before the node is ready.
+        """
+        start_time = time.time()
+        while not ready_event.wait(READY_CHECK_INTERVAL_S):
+            if not runner.is_running():
+                raise NodeUnexpectedTerminationError(str(type(runner)))
+
+            # if the node takes too long to initialize, abort
+            if (time.time() - start_time) > runner.READY_TIMEOUT_SEC:
+                raise NodeTimeoutError(str(type(runner)))
+
+    def _compute_goal(
+        self, config: configuration.JobConfig, src_dir: str
+    ) -> str:
+        """Compute the goal and log it.
+
+        Args:
+            config: Job configuration.
+            src_dir: Path to the workspace source.
+
+        Returns:
+            The JSON-encoded goal as string.
+        """
+        goal = json_goal_from_goal_config(config, src_dir)
+        self.get_logger().info("Goal: {}".format(goal))
+
+        return goal
+
+    def _start_spinning(self) -> rclpy.executors.Executor:
+        """Spin the node in a background thread.
+
+        This way callbacks are processed as soon as messages arrive, without
+        blocking the main thread.
+
+        Returns:
+            The executor spinning the node.  Call its ``shutdown()`` method to
+            stop spinning.
+        """
+        executor = rclpy.executors.SingleThreadedExecutor()
+        executor.add_node(self)
+        spin_thread = threading.Thread(target=executor.spin, daemon=True)
+        spin_thread.start()
+
+        return executor
+
+    def _shutdown_data(self):
+        """Ask the data node to shut down."""
+        self.get_logger().info("Shut down data node.")
+        self.data_shutdown.call_async(Empty.Request())
+
+    def _shutdown_backend(self):
+        """Ask the robot back end node to shut down."""
+        self.get_logger().info("Shut down robot backend node.")
+        self.backend_shutdown.call_async(Empty.Request())
+
+    def _terminate_user(self, user_code_runner: UserCodeRunner):
+        """Kill the user node."""
+        self.get_logger().info("Kill user node.")
+        user_code_runner.kill()
+
+    def _terminate_user_after_grace_time(
+        self, user_code_runner: UserCodeRunner
+    ):
+        """Give the user node some time to stop by itself, then kill it."""
+        # returns as soon as the user code terminates
+        if not user_code_runner.wait(timeout=USER_GRACE_TIME_S):
+            self._terminate_user(user_code_runner)
+
+    def _monitor_nodes(
+        self,
+        data_runner: DataRunner,
+        backend_runner: BaseBackendRunner,
+        user_code_runner: UserCodeRunner,
+    ) -> bool:
+        """Monitor running nodes and wait until all have terminated.
+
+        Checks the status of data, robot backend and user nodes in a loop.  If
+        one of them terminates, the other two are shut down in the appropriate
+        order.
+        """
+        # actions taken on state changes (see make_state_tables())
+        action_handlers = {
+            MonitorAction.NONE: lambda: None,
+            MonitorAction.SHUTDOWN_BACKEND: self._shutdown_backend,
+            MonitorAction.SHUTDOWN_DATA: self._shutdown_data,
+            MonitorAction.TERMINATE_USER: lambda: self._terminate_user(
+                user_code_runner
+            ),
+            MonitorAction.TERMINATE_USER_AFTER_GRACE_TIME: (
+                lambda: self._terminate_user_after_grace_time(
+                    user_code_runner
+                )
+            ),
+        }
+        # runners that are expected to terminate after an action
+        affected_runners: typing.Dict[MonitorAction, Runner] = {
+            MonitorAction.SHUTDOWN_BACKEND: backend_runner,
+            MonitorAction.SHUTDOWN_DATA: data_runner,
+            MonitorAction.TERMINATE_USER: user_code_runner,
+            MonitorAction.TERMINATE_USER_AFTER_GRACE_TIME: user_code_runner,
+        }
+
+        # monitor running nodes and handle shutdown using a state machine
+        self.get_logger().info("Monitor nodes...")
+        error = False
+        previous_state = LAUNCHER_STATES[
+            (ProcessState.RUNNING, ProcessState.RUNNING, ProcessState.RUNNING)
+        ]
+        # wait for process terminations instead of polling the states in a
+        # fixed interval (falls back to the latter if not supported)
+        exit_watcher = ExitWatcher(
+            [data_runner, backend_runner, user_code_runner], poll_interval=3
+        )
+        terminated_after_action = False
+        while True:
+            if not terminated_after_action:
+                exit_watcher.wait()
+
+            # update state (runners that terminated already are not polled
+            # again)
+            key = (
+                data_runner.get_state(),
+                backend_runner.get_state(),
+                user_code_runner.get_state(),
+            )
+            state = LAUNCHER_STATES[key]
+
+            # only take action if state changes
+            if state is not previous_state:
+                self.get_logger().info(
+                    "State %s --> %s" % (previous_state, state)
+                )
+                previous_state = state
+
+                # the table covers all combinations of concrete states
+                action, is_error = STATE_TRANSITIONS[key]
+
+                error = error or is_error
+
+                if action is MonitorAction.FINISH:
+                    break
+
+                action_handlers[action]()
+
+                # Wait directly for the node affected by the action, so the
+                # next state is evaluated as soon as it terminated (when
+                # polling, this would otherwise only happen in the next
+                # interval).
+                affected_runner = affected_runners.get(action)
+                terminated_after_action = (
+                    affected_runner is not None
+                    and affected_runner.wait(SHUTDOWN_WAIT_S)
+                )
+            else:
+                terminated_after_action = False
+
+        exit_watcher.close()
+
+        return not error
+
+    def run(
+        self,
+        config: configuration.JobConfig,
+        ws_dir: str,
+        backend_type: BackendType,
+        backend_kwargs: dict = {},
+    ):
+        """Run a job on the robot.
+
+        Based on the given configuration the user code is fetched and built.
+        Then the robot is started and, when ready, the user code is executed.
+        Then the running nodes are monitored and terminated in the appropriate
+        order.
+
+        Args:
+            config: Configuration containing information about the user's git
+                repository, which Singularity images to use, etc.
+            ws_dir: Directory in which the user code is cloned and built.
+            backend_type: Which type of back end to use (e.g. robot or
+                simulation).
+            backend_kwargs: Optional arguments that are passed to the backend
+                constructor as kwargs.
+        """
+        self.get_logger().info("Starting...")
+
+        data_runner = DataRunner(config, logger=self.get_logger())
+
+        backend_runner: BaseBackendRunner
+        if backend_type == BackendType.ROBOT:
+            backend_runner = BackendRunner(config, **backend_kwargs)
+        elif backend_type == BackendType.SIMULATION:
+            backend_runner = SimulationBackendRunner(config, **backend_kwargs)
+        elif backend_type == BackendType.LOG_REPLAY:
+            backend_runner = LogReplayBackendRunner(config, **backend_kwargs)
+        else:
+            raise ValueError(
+                "Unsupported backend type {}".format(backend_type.name)
+            )
+
+        user_code_runner = UserCodeRunner(
+            config,
+            ws_dir,
+        )
+
+        #
+        # Preparation
+        #
+
+        # create "src" directory
+        src_dir = os.path.join(ws_dir, "src")
+        os.mkdir(src_dir)
+
+        # Cloning the user repository is independent of the other steps below,
+        # so run them concurrently (they are mostly waiting for I/O).
+        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+            clone_future = executor.submit(
+                clone_user_repository, config, src_dir
+            )
+
+            # warm up the page cache for the Singularity images
+            for image in {
+                config.singularity_backend_image,
+                config.singularity_user_image,
+            }:
+                executor.submit(actions.prefetch_singularity_image, image)
+
+            # camera files are only meaningful on the real robot
+            if backend_type == BackendType.ROBOT:
+                calib_future = executor.submit(
+                    actions.store_camera_calibration_files, config
+                )
+                calib_future.result()
+
+            git_revision = clone_future.result()
+
+            # Computing the goal and building the user code both only depend
+            # on the clone, so run them concurrently as well.
+            goal_future = executor.submit(self._compute_goal, config, src_dir)
+            build_future = executor.submit(
+                build_user_code, config, git_revision, ws_dir
+            )
+
+            # create meta data files
+            actions.store_info_file(config, git_revision)
+
+            goal = goal_future.result()
+            build_future.result()
+
+        #
+        # Starting Nodes
+        #
+
+        # process status messages and service responses in the background
+        ros_executor = self._start_spinning()
+        try:
+            # run data node and wait until it is ready
+            data_runner.start()
+            self._wait_until_node_is_ready(data_runner, self.data_node_ready)
+
+            # run robot backend and wait until it is ready
+            backend_runner.start(FIRST_ACTION_TIMEOUT_S)
+            self._wait_until_node_is_ready(
+                backend_runner, self.backend_node_ready
+            )
+
+            # run user code
+            user_code_runner.start(goal)
+
+            #
+            # Monitor running nodes and handle shutdown
+            #
+            success = self._monitor_nodes(
+                data_runner, backend_runner, user_code_runner
+            )
+        finally:
+            # stop spinning before the node is destroyed by the caller
+            ros_executor.shutdown()
+
+            data_runner.close()
+            backend_runner.close()
+            user_code_runner.close()
+
+        if success:
+            self.get_logger().info("Done.")
+        else:
+            self.get_logger().error("Finished with error.")
+
+        # create the report last, so it can be used as indicator that
+        # the execution is over
+        backend_error = backend_runner.returncode != 0
+        actions.store_report(
+            config, backend_error, user_code_runner.returncode
+        )
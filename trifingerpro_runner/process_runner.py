@@ -0,0 +1,230 @@
+"""Base class for runners that execute a subprocess."""
+
+__copyright__ = "Copyright (c) 2021 Max Planck Gesellschaft"
+__license__ = "BSD 3-Clause"
+
+import os
+import select
+import subprocess
+import time
+import typing
+
+from .states import ProcessState
+
+
+def _pidfd_open(pid: int) -> typing.Optional[int]:
+    """Get a file descriptor referring to the process with the given PID.
+
+    Returns:
+        The pidfd or None if this is not supported on the system (requires
+        Linux >= 5.3 and Python >= 3.9).
+    """
+    try:
+        return os.pidfd_open(pid)  # type: ignore
+    except (AttributeError, OSError):
+        return None
+
+
+class ProcessRunner:
+    """Base class for runners that start and monitor a single subprocess."""
+
+    #: Return code of the process (None while it is still running).
+    returncode: typing.Optional[int] = None
+
+    _proc: subprocess.Popen
+    _pidfd: typing.Optional[int] = None
+    #: Final state of the process (None while it is still running).
+    _cached_state: typing.Optional[ProcessState] = None
+
+    def _start_process(self, cmd: typing.List[str], **kwargs):
+        """Start the process.
+
+        Args:
+            cmd: The command that is executed.
+            kwargs: Additional keyword arguments for ``subprocess.Popen``.
+        """
+        self._proc = subprocess.Popen(cmd, **kwargs)
+        self._pidfd = _pidfd_open(self._proc.pid)
+
+    @property
+    def pidfd(self) -> typing.Optional[int]:
+        """File descriptor referring to the process.
+
+        None if the process has not been started yet or if pidfds are not
+        supported on the system.
+        """
+        return self._pidfd
+
+    def _set_returncode(self, returncode: typing.Optional[int]):
+        """Set the return code and, if it is set, the final state."""
+        self.returncode = returncode
+        if returncode == 0:
+            self._cached_state = ProcessState.TERMINATED_SUCCESS
+        elif returncode is not None:
+            self._cached_state = ProcessState.TERMINATED_ERROR
+
+    def is_running(self) -> bool:
+        """Check if the process is still running."""
+        # once the process terminated, there is no need to poll it anymore
+        if self._cached_state is not None:
+            return False
+
+        self._set_returncode(self._proc.poll())
+        return self.returncode is None
+
+    def get_state(self) -> ProcessState:
+        """Get the current state of the process."""
+        if self.is_running():
+            return ProcessState.RUNNING
+        else:
+            assert self._cached_state is not None
+            return self._cached_state
+
+    def wait(self, timeout: typing.Optional[float] = None) -> bool:
+        """Wait until the process terminates.
+
+        Args:
+            timeout: Maximum time to wait in seconds.  If None, wait without
+                timeout.
+
+        Returns:
+            True if the process terminated, False if the timeout expired.
+        """
+        try:
+            self._proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            pass
+
+        return not self.is_running()
+
+    def close(self):
+        """Release the resources held for monitoring the process."""
+        if self._pidfd is not None:
+            os.close(self._pidfd)
+            self._pidfd = None
+
+
+class _ProcessGroupWaiter:
+    """Detect termination of the processes of a set of runners.
+
+    Instead of polling each process individually, a single
+    ``waitid(P_ALL, WNOWAIT)`` call is used to check if any child process
+    has exited.  Since WNOWAIT does not reap the process, the corresponding
+    runner can still get the return code in the usual way.
+
+    Args:
+        runners: The runners whose processes are watched (they need to be
+            started already).
+    """
+
+    def __init__(self, runners: typing.Sequence[ProcessRunner]):
+        self._running = {runner._proc.pid: runner for runner in runners}
+
+    def all_terminated(self) -> bool:
+        """Check if termination of all processes has been reported."""
+        return not self._running
+
+    def check(self) -> bool:
+        """Check if any of the processes terminated since the last call.
+
+        Returns:
+            True if at least one process terminated.
+        """
+        terminated = False
+
+        # Processes that have already been reaped (e.g. by waiting for them)
+        # are not reported by waitid anymore.
+        for pid, runner in list(self._running.items()):
+            if runner.returncode is not None:
+                del self._running[pid]
+                terminated = True
+
+        while self._running:
+            try:
+                result = os.waitid(
+                    os.P_ALL, 0, os.WEXITED | os.WNOHANG | os.WNOWAIT
+                )
+            except ChildProcessError:
+                break
+            if result is None:
+                break
+
+            runner = self._running.pop(result.si_pid, None)
+            if runner is None:
+                # Some other child process exited, which blocks the reporting
+                # of further processes.  Fall back to checking each process.
+                for pid, runner in list(self._running.items()):
+                    if not runner.is_running():
+                        del self._running[pid]
+                        terminated = True
+                break
+
+            # this reaps the process, so the next call of waitid can report
+            # another one
+            runner.is_running()
+            terminated = True
+
+        return terminated
+
+
+class ExitWatcher:
+    """Wait for the processes of a set of runners to terminate.
+
+    If pidfds are supported, all processes are watched with a single epoll
+    instance, so :meth:`wait` only returns when a process actually terminated.
+    Otherwise it falls back to checking all processes in a fixed interval
+    (using a single ``waitid`` call per check).
+
+    Args:
+        runners: The runners whose processes are watched (they need to be
+            started already).
+        poll_interval: Time in seconds between checks when pidfds are not
+            supported.
+    """
+
+    def __init__(
+        self,
+        runners: typing.Sequence[ProcessRunner],
+        poll_interval: float,
+    ):
+        self._poll_interval = poll_interval
+        self._epoll: typing.Optional[select.epoll] = None
+        self._watched_fds: typing.Set[int] = set()
+
+        pidfds = [runner.pidfd for runner in runners]
+        if None not in pidfds:
+            self._epoll = select.epoll()
+            for pidfd in pidfds:
+                self._epoll.register(pidfd, select.EPOLLIN)
+                self._watched_fds.add(pidfd)
+        else:
+            self._waiter = _ProcessGroupWaiter(runners)
+
+    @property
+    def is_event_driven(self) -> bool:
+        """True if pidfds are used, False if processes are polled."""
+        return self._epoll is not None
+
+    def wait(self):
+        """Wait until one of the processes terminated."""
+        if self._epoll is None:
+            while not (self._waiter.all_terminated() or self._waiter.check()):
+                time.sleep(self._poll_interval)
+            return
+
+        # nothing to wait for if all processes terminated already
+        if not self._watched_fds:
+            return
+
+        for fd, _ in self._epoll.poll():
+            # the pidfd of a terminated process stays readable, so stop
+            # watching it (otherwise poll() would return immediately from now
+            # on)
+            self._epoll.unregister(fd)
+            self._watched_fds.discard(fd)
+
+    def close(self):
+        """Release the epoll instance."""
+        if self._epoll is not None:
+            self._epoll.close()
+            self._epoll = None
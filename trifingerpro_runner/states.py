@@ -4,6 +4,8 @@ __copyright__ = "Copyright (c) 2021 Max Planck Gesellschaft"
 __license__ = "BSD 3-Clause"
 
 import enum
+import itertools
+import typing
 
 
 class ProcessState(enum.Enum):
@@ -22,6 +24,16 @@ class ProcessState(enum.Enum):
     TERMINATED_ANY = 3
 
 
+#: Bit masks used for comparing process states.  Two states are considered
+#: equal if their masks have at least one bit in common.
+_STATE_BITS = {
+    ProcessState.TERMINATED_SUCCESS: 0b001,
+    ProcessState.TERMINATED_ERROR: 0b010,
+    ProcessState.RUNNING: 0b100,
+    ProcessState.TERMINATED_ANY: 0b011,
+}
+
+
 class ProcessStateCompareWrapper:
     """Wrapper around ProcessState to provide proper ``__eq__`` handling of GOOD_OR_BAD.
 
@@ -33,22 +45,10 @@ class ProcessStateCompareWrapper:
 
     def __init__(self, state: ProcessState):
         self.state = state
+        self.bits = _STATE_BITS[state]
 
     def __eq__(self, other):
-        if self.state == other.state:
-            return True
-        elif self.state == ProcessState.TERMINATED_ANY and other.state in (
-            ProcessState.TERMINATED_SUCCESS,
-            ProcessState.TERMINATED_ERROR,
-        ):
-            return True
-        elif other.state == ProcessState.TERMINATED_ANY and self.state in (
-            ProcessState.TERMINATED_SUCCESS,
-            ProcessState.TERMINATED_ERROR,
-        ):
-            return True
-        else:
-            return False
+        return bool(self.bits & other.bits)
 
     def __repr__(self):
         # only print the plain state name
@@ -76,8 +76,132 @@ class LauncherState:
             except Exception:
                 return False
 
-        return (
-            (self.data_state == other.data_state)
-            and (self.backend_state == other.backend_state)
-            and (self.user_state == other.user_state)
+        return bool(
+            (self.data_state.bits & other.data_state.bits)
+            and (self.backend_state.bits & other.backend_state.bits)
+            and (self.user_state.bits & other.user_state.bits)
         )
+
+
+#: Key of the state tables below: states of (data, backend, user) nodes.
+StateKey = typing.Tuple[ProcessState, ProcessState, ProcessState]
+
+
+class MonitorAction(enum.Enum):
+    """Actions that are taken by the launcher when the state changes."""
+
+    NONE = 0
+    SHUTDOWN_BACKEND = 1
+    SHUTDOWN_DATA = 2
+    TERMINATE_USER = 3
+    TERMINATE_USER_AFTER_GRACE_TIME = 4
+    FINISH = 5
+
+
+def make_state_tables() -> typing.Tuple[
+    typing.Dict[StateKey, LauncherState],
+    typing.Dict[StateKey, typing.Tuple[MonitorAction, bool]],
+]:
+    """Create the lookup tables for the state machine of the launcher.
+
+    The transitions are defined using TERMINATED_ANY where the exact result
+    does not matter.  They are expanded here to all concrete combinations of
+    process states, so that no custom comparisons are needed at runtime.
+
+    Returns:
+        Tuple (launcher_states, transitions).  launcher_states contains one
+        LauncherState instance per concrete state (so they can be compared by
+        identity).  transitions maps each expected state to the action that is
+        taken when entering it and a flag indicating whether it is an error.
+    """
+    RUNNING = ProcessStateCompareWrapper(ProcessState.RUNNING)
+    SUCCESS = ProcessStateCompareWrapper(ProcessState.TERMINATED_SUCCESS)
+    ERROR = ProcessStateCompareWrapper(ProcessState.TERMINATED_ERROR)
+    TERMINATED_ANY = ProcessStateCompareWrapper(ProcessState.TERMINATED_ANY)
+
+    # (state, action, is_error) in order of precedence
+    transition_rules = [
+        # while all nodes are running, do nothing
+        ((RUNNING, RUNNING, RUNNING), MonitorAction.NONE, False),
+        # If user code terminated while the robot is still running, stop the
+        # robot immediately.
+        #
+        # TODO: This case is tricky.  It might be all right if the user code
+        # terminates immediately after sending the last action (which would
+        # be a successful run) but it might also mean that the run is aborted
+        # somewhere in the middle, which means it should be considered as
+        # failed.
+        (
+            (RUNNING, RUNNING, TERMINATED_ANY),
+            MonitorAction.SHUTDOWN_BACKEND,
+            False,
+        ),
+        # If the robot back end terminates before the user node, give the
+        # latter some time to wrap up and stop by itself.  If it is still
+        # running after this time, kill it.  An error of the robot back end is
+        # reported.
+        (
+            (RUNNING, SUCCESS, RUNNING),
+            MonitorAction.TERMINATE_USER_AFTER_GRACE_TIME,
+            False,
+        ),
+        (
+            (RUNNING, ERROR, RUNNING),
+            MonitorAction.TERMINATE_USER_AFTER_GRACE_TIME,
+            True,
+        ),
+        # After both user node and robot back end have terminated, the data
+        # node can be stopped.  An error of the robot back end is reported.
+        (
+            (RUNNING, SUCCESS, TERMINATED_ANY),
+            MonitorAction.SHUTDOWN_DATA,
+            False,
+        ),
+        ((RUNNING, ERROR, TERMINATED_ANY), MonitorAction.SHUTDOWN_DATA, True),
+        # If the data node terminates while any of the other is still
+        # running, this is an error.  Shut down the other nodes (first user
+        # node then robot back end) and report the error.
+        (
+            (TERMINATED_ANY, RUNNING, RUNNING),
+            MonitorAction.TERMINATE_USER,
+            True,
+        ),
+        (
+            (TERMINATED_ANY, RUNNING, TERMINATED_ANY),
+            MonitorAction.SHUTDOWN_BACKEND,
+            True,
+        ),
+        (
+            (TERMINATED_ANY, TERMINATED_ANY, RUNNING),
+            MonitorAction.TERMINATE_USER,
+            True,
+        ),
+        # terminal states
+        # end with success :)
+        ((SUCCESS, SUCCESS, TERMINATED_ANY), MonitorAction.FINISH, False),
+        # end with failure
+        ((ERROR, SUCCESS, TERMINATED_ANY), MonitorAction.FINISH, True),
+        ((TERMINATED_ANY, ERROR, TERMINATED_ANY), MonitorAction.FINISH, True),
+    ]
+
+    launcher_states = {}
+    transitions = {}
+    concrete_states = (
+        ProcessState.RUNNING,
+        ProcessState.TERMINATED_SUCCESS,
+        ProcessState.TERMINATED_ERROR,
+    )
+    for key in itertools.product(concrete_states, repeat=3):
+        state = LauncherState(*map(ProcessStateCompareWrapper, key))
+        launcher_states[key] = state
+
+        for rule_state, action, is_error in transition_rules:
+            if state == rule_state:
+                transitions[key] = (action, is_error)
+                break
+
+    return launcher_states, transitions
+
+
+#: Lookup tables of the launcher state machine (see make_state_tables()).
+LAUNCHER_STATES, STATE_TRANSITIONS = make_state_tables()
@@ -1,40 +1,32 @@
 __copyright__ = "Copyright (c) 2021 Max Planck Gesellschaft"
 __license__ = "BSD 3-Clause"
 
-import json
 import logging
 import os
-import subprocess
 
+from . import json_utils
 from .configuration import JobConfig, OutputFiles
+from .process_runner import ProcessRunner
 
 
-class UserCodeRunner:
+class UserCodeRunner(ProcessRunner):
     def __init__(self, config: JobConfig, workspace_path: str):
         self.config = config
         self.workspace_path = workspace_path
 
-    def start(self, goal):
-        """Run the user script."""
-        logging.info("Run the user code.")
-
-        # create user output directory if it does not yet exist
-        user_output_dir = os.path.join(self.config.host_output_dir, "user")
-        if not os.path.exists(user_output_dir):
-            os.mkdir(user_output_dir)
-
-        # store the goal to a file
-        goal_file = os.path.join(self.config.host_output_dir, OutputFiles.goal)
-        goal_info = {
-            "goal": json.loads(goal) if goal else None,
-        }
-        with open(goal_file, "w") as fh:
-            json.dump(goal_info, fh, indent=4)
+        # paths of the output files
+        output_dir = config.host_output_dir
+        self._user_output_dir = os.path.join(output_dir, "user")
+        self._goal_file = os.path.join(output_dir, OutputFiles.goal)
+        self._stdout_path = os.path.join(output_dir, OutputFiles.user_stdout)
+        self._stderr_path = os.path.join(output_dir, OutputFiles.user_stderr)
 
+        # The command does not depend on the goal, so it can be prepared here
+        # already.
         exec_cmd = (
             ". /setup.bash;"
             ". /ws/install/local_setup.bash;"
-            "/ws/src/usercode/run {!r}"
+            '/ws/src/usercode/run "$TRIFINGER_GOAL"'
         )
 
         # binding full /dev as only binding /dev/shm does not work with
@@ -43,7 +35,7 @@ class UserCodeRunner:
             "{}:/ws".format(self.workspace_path),
             "/dev",
             "/etc/trifingerpro:/etc/trifingerpro:ro",
-            "{}:/output".format(user_output_dir),
+            "{}:/output".format(self._user_output_dir),
         ]
         if self.config.host_user_data_dir:
             # FIXME 'userhome' might not be the best name
@@ -56,6 +48,7 @@ class UserCodeRunner:
             "exec",
             "--cleanenv",
             "--contain",
+            "--sif-fuse" if self.config.singularity_sif_fuse else None,
             "--net",
             "--network",
             "none",
@@ -64,31 +57,55 @@ class UserCodeRunner:
             self.config.singularity_user_image,
             "bash",
             "-c",
-            exec_cmd.format(goal),
+            exec_cmd,
         ]
+        self._run_user_cmd = [c for c in run_user_cmd if c is not None]
 
-        # open the output files
-        stdout_filename = os.path.join(
-            self.config.host_output_dir, OutputFiles.user_stdout
-        )
-        stderr_filename = os.path.join(
-            self.config.host_output_dir, OutputFiles.user_stderr
-        )
-        self.stdout_file = open(stdout_filename, "wb")
-        self.stderr_file = open(stderr_filename, "wb")
+    def start(self, goal):
+        """Run the user script."""
+        logging.info("Run the user code.")
 
-        self._proc = subprocess.Popen(
-            run_user_cmd,
-            stdout=self.stdout_file,
-            stderr=self.stderr_file,
-        )
+        # create user output directory if it does not yet exist
+        if not os.path.exists(self._user_output_dir):
+            os.mkdir(self._user_output_dir)
 
-    def is_running(self):
-        self.returncode = self._proc.poll()
-        return self.returncode is None
+        # store the goal to a file (parsing the goal also makes sure that it
+        # is valid JSON)
+        goal_info = {
+            "goal": json_utils.loads(goal) if goal else None,
+        }
+        json_utils.dump(goal_info, self._goal_file)
+
+        # The goal is passed via an environment variable (Singularity sets
+        # SINGULARITYENV_* variables in the container even with --cleanenv),
+        # so it does not need to be quoted for the shell.
+        env = dict(os.environ, SINGULARITYENV_TRIFINGER_GOAL=goal or "")
+
+        # Use plain file descriptors, the user code writes to them directly.
+        # They are only needed by the child process, so close them right after
+        # it has been started.
+        open_flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC
+        stdout_fd = os.open(self._stdout_path, open_flags, 0o644)
+        stderr_fd = os.open(self._stderr_path, open_flags, 0o644)
+        try:
+            # Explicitly close all other file descriptors, so that nothing of
+            # the launcher leaks to the user code.  Descriptors opened by
+            # native libraries (e.g. the DDS sockets of ROS) are not
+            # guaranteed to be non-inheritable.
+            self._start_process(
+                self._run_user_cmd,
+                env=env,
+                stdout=stdout_fd,
+                stderr=stderr_fd,
+                close_fds=True,
+            )
+        finally:
+            os.close(stdout_fd)
+            os.close(stderr_fd)
 
-    def _wait(self, timeout=None):
-        self.returncode = self._proc.wait(timeout=timeout)
+    def wait(self, timeout=None):
+        if not super().wait(timeout):
+            return False
 
         if self.returncode == 0:
             logging.info("User code terminated.")
@@ -98,13 +115,8 @@ class UserCodeRunner:
                 self.returncode,
             )
 
-    def wait(self, timeout=None):
-        try:
-            self._wait(timeout)
-            return True
-        except subprocess.TimeoutExpired as e:
-            return False
+        return True
 
     def kill(self):
         self._proc.kill()
-        self._wait()
+        self.wait()